@@ -1,12 +1,17 @@
-import random
 import math
-from typing import List, Dict, Any, Set, TypedDict
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Any, Optional, Tuple, TypedDict, Union
+import numpy as np
 from scipy.stats import ttest_1samp
 
 # --- 1. CONFIGURATION & SETUP ---
 
 # --- Simulation Settings ---
 NUM_SIMULATIONS = 10000 # Reduced for quicker testing, can be increased
+SIMULATION_BATCH_SIZE = 1000 # Runs shuffled together per vectorized batch
+NUM_WORKERS = os.cpu_count() or 1 # Processes sharing the batches
+RANDOM_SEED: Optional[int] = None # Set to an int for reproducible runs
 
 # --- Gachapon Machine Contents ---
 ITEMS: List[str] = ["Cat Keychain", "Dog Keychain", "Rabbit Figurine", "Hamster Sticker", "Rare Gold Cat"]
@@ -14,6 +19,24 @@ CAPSULES_PER_ITEM: int = 50
 NUM_ITEM_TYPES: int = len(ITEMS)
 TOTAL_CAPSULES: int = NUM_ITEM_TYPES * CAPSULES_PER_ITEM
 
+# Every capsule in the machine, as item indices into ITEMS
+_ITEM_IDS = np.arange(NUM_ITEM_TYPES, dtype=np.int8)
+_BASE_DECK = np.repeat(_ITEM_IDS, CAPSULES_PER_ITEM)
+
+# --- Snapshot Checkpoints ---
+# Remaining capsules at which each fullness level is recorded
+SNAPSHOT_LEVELS: Dict[str, int] = {
+    '100%': TOTAL_CAPSULES,
+    '75%': int(TOTAL_CAPSULES * 0.75),
+    '50%': int(TOTAL_CAPSULES * 0.50),
+    '25%': int(TOTAL_CAPSULES * 0.25)
+}
+# (level, pulls needed to reach it), in the order the levels are crossed
+_SNAPSHOT_PULLS: Tuple[Tuple[str, int], ...] = tuple(
+    (level_name, TOTAL_CAPSULES - level_value)
+    for level_name, level_value in sorted(SNAPSHOT_LEVELS.items(), key=lambda kv: -kv[1])
+)
+
 # --- Customer Behavior Models ---
 ITEM_POPULARITY: Dict[str, float] = {
     "Cat Keychain": 0.00,
@@ -28,8 +51,15 @@ MAX_PULLS_PER_ITEM: Dict[str, Dict[int, float]] = {
     "Default": {10000000: 1.0}
 }
 
+# Simplified based on 100% popularity: every customer wants the same item
+_DESIRED_ITEM = "Rare Gold Cat"
+_DESIRED_ITEM_ID = ITEMS.index(_DESIRED_ITEM)
+_MAX_PULLS = list(MAX_PULLS_PER_ITEM[_DESIRED_ITEM].keys())[0]
+
 
 # Define clear data structures for type hinting
+SeedLike = Union[int, np.random.SeedSequence]
+
 class CustomerOutcome(TypedDict):
     desired_item: str
     got_item: bool
@@ -38,77 +68,114 @@ class CustomerOutcome(TypedDict):
 # --- CHANGE 1: The result of a simulation is now cleaner ---
 # It no longer contains the massive state_history list.
 class SimulationResult(TypedDict):
-    snapshots: Dict[str, Dict[str, int]]
+    snapshots: Dict[str, Tuple[int, ...]] # Remaining counts, in ITEMS order
     customer_outcomes: List[CustomerOutcome]
     depletion_points: Dict[str, int]
 
 
-# --- 2. SINGLE SIMULATION LOGIC (REWRITTEN) ---
+# --- 2. SIMULATION LOGIC (VECTORIZED) ---
 
-def run_single_simulation() -> SimulationResult:
-    """
-    Runs one full simulation, capturing unbiased snapshots at the exact
-    moment checkpoints are crossed.
-    """
-    gachapon_contents: Dict[str, int] = {item: CAPSULES_PER_ITEM for item in ITEMS}
+def _simulate_customers(deck: np.ndarray) -> List[CustomerOutcome]:
+    """Replays the customer turns over one run's pull order."""
     customer_outcomes: List[CustomerOutcome] = []
-    depleted_pull_number: Dict[str, int] = {}
-    total_pull_counter = 0
 
-    # --- Unbiased Snapshot Logic ---
-    # Define the levels and data structures for this specific run
-    snapshots_found: Dict[str, Dict[str, int]] = {}
-    snapshot_levels = {
-        '100%': TOTAL_CAPSULES,
-        '75%': int(TOTAL_CAPSULES * 0.75),
-        '50%': int(TOTAL_CAPSULES * 0.50),
-        '25%': int(TOTAL_CAPSULES * 0.25)
-    }
-    processed_levels: Set[str] = set()
+    # Each customer pulls until they hit the desired item or run out of patience.
+    desired_item = _DESIRED_ITEM
+    max_pulls = _MAX_PULLS
 
-    # Immediately capture the 100% state
-    snapshots_found['100%'] = gachapon_contents.copy()
-    processed_levels.add('100%')
+    hit_ends = np.flatnonzero(deck == _DESIRED_ITEM_ID) + 1
+    gaps = np.diff(hit_ends, prepend=0)
+    tail = TOTAL_CAPSULES - (int(hit_ends[-1]) if hit_ends.size else 0)
 
+    # A gap longer than max_pulls is split into customers who gave up, followed
+    # by the one whose turn ends on the hit.
+    gave_up = (gaps - 1) // max_pulls
+    turns_per_gap = gave_up + 1
+    hit_turns = np.cumsum(turns_per_gap) - 1
 
-    while sum(gachapon_contents.values()) > 0:
-        desired_item = "Rare Gold Cat" # Simplified based on 100% popularity
-        pull_distribution = MAX_PULLS_PER_ITEM["Rare Gold Cat"]
-        max_pulls = list(pull_distribution.keys())[0]
+    pulls_taken = np.full(int(turns_per_gap.sum()), max_pulls, dtype=np.int64)
+    pulls_taken[hit_turns] = gaps - gave_up * max_pulls
+    got_item = np.zeros(pulls_taken.size, dtype=bool)
+    got_item[hit_turns] = True
 
-        pulls_this_turn = 0
-        got_item = False
+    # Whoever is pulling when the machine runs dry leaves empty-handed
+    tail_pulls = [max_pulls] * (tail // max_pulls) + ([tail % max_pulls] if tail % max_pulls else [])
 
-        for _ in range(max_pulls):
-            if sum(gachapon_contents.values()) == 0:
-                break
+    for pulls, got in zip(pulls_taken.tolist(), got_item.tolist()):
+        customer_outcomes.append({"desired_item": desired_item, "got_item": got, "pulls_taken": pulls})
+    for pulls in tail_pulls:
+        customer_outcomes.append({"desired_item": desired_item, "got_item": False, "pulls_taken": pulls})
 
-            pulls_this_turn += 1
-            total_pull_counter += 1
+    return customer_outcomes
 
-            capsule_pool = [item for item, count in gachapon_contents.items() for _ in range(count)]
-            pulled_item = random.choice(capsule_pool)
-            gachapon_contents[pulled_item] -= 1
 
-            # --- CHANGE 2: The snapshot is taken HERE, after every single pull ---
-            # This decouples the measurement from the turn-ending event.
-            remaining_capsules = sum(gachapon_contents.values())
-            for level_name, level_value in snapshot_levels.items():
-                if remaining_capsules <= level_value and level_name not in processed_levels:
-                    snapshots_found[level_name] = gachapon_contents.copy()
-                    processed_levels.add(level_name)
+def _simulate_batch_arrays(num_runs: int, seed: Optional[SeedLike] = None
+                           ) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Shuffles `num_runs` decks and tallies them into arrays.
 
-            if gachapon_contents[pulled_item] == 0 and pulled_item not in depleted_pull_number:
-                depleted_pull_number[pulled_item] = total_pull_counter
+    Returns the decks (runs, pulls), the snapshot counts
+    (runs, levels, items) in SNAPSHOT_LEVELS order, and the depletion
+    pull numbers (runs, items).
+    """
+    rng = np.random.default_rng(seed)
+    decks = rng.permuted(np.tile(_BASE_DECK, (num_runs, 1)), axis=1)
+    # Offsetting each row's item ids lets one bincount tally every run at once
+    run_item_ids = decks + (np.arange(num_runs) * NUM_ITEM_TYPES)[:, None]
 
-            if pulled_item == desired_item:
-                got_item = True
-                break
+    # --- Unbiased Snapshot Logic ---
+    # A level is crossed on the pull that leaves `level_value` capsules behind,
+    # so the state at that moment is everything not yet in decks[:, :pulls].
+    # Walking the levels in the order they are crossed means each checkpoint
+    # only has to tally the pulls made since the previous one.
+    level_names = list(SNAPSHOT_LEVELS)
+    snapshot_counts = np.empty((num_runs, len(level_names), NUM_ITEM_TYPES), dtype=np.int64)
+    pulled = np.zeros((num_runs, NUM_ITEM_TYPES), dtype=np.int64)
+    pulls_done = 0
+    for level_name, pulls_needed in _SNAPSHOT_PULLS:
+        pulled += np.bincount(run_item_ids[:, pulls_done:pulls_needed].ravel(),
+                              minlength=num_runs * NUM_ITEM_TYPES).reshape(num_runs, NUM_ITEM_TYPES)
+        pulls_done = pulls_needed
+        snapshot_counts[:, level_names.index(level_name)] = CAPSULES_PER_ITEM - pulled
+
+    # An item is depleted on the pull that takes its last capsule. A stable sort
+    # groups each item's pull positions in order, so every CAPSULES_PER_ITEM-th
+    # entry is the position of an item's final capsule.
+    pull_order = np.argsort(decks, axis=1, kind='stable')
+    depletion_points = pull_order[:, CAPSULES_PER_ITEM - 1::CAPSULES_PER_ITEM] + 1
+
+    return decks, snapshot_counts, depletion_points
+
+
+def run_batch_simulations(num_runs: int, seed: Optional[SeedLike] = None) -> List[SimulationResult]:
+    """
+    Runs `num_runs` full simulations at once, capturing unbiased snapshots at
+    the exact moment checkpoints are crossed.
 
-        customer_outcomes.append({"desired_item": desired_item, "got_item": got_item, "pulls_taken": pulls_this_turn})
+    Pulling without replacement until the machine is empty is the same as
+    shuffling every capsule once, so each shuffled row of `decks` IS the pull
+    order of one run. All rows are shuffled in a single call.
+
+    Each batch draws from its own generator built from `seed`, so batches can
+    run in separate processes without sharing RNG state.
+    """
+    decks, snapshot_counts, depletion_points = _simulate_batch_arrays(num_runs, seed)
+    snapshot_rows = snapshot_counts.tolist()
+    depletion_rows = depletion_points.tolist()
+
+    return [
+        {
+            "snapshots": {level_name: tuple(counts) for level_name, counts in zip(SNAPSHOT_LEVELS, snapshot_rows[run])},
+            "customer_outcomes": _simulate_customers(decks[run]),
+            "depletion_points": dict(zip(ITEMS, depletion_rows[run])),
+        }
+        for run in range(num_runs)
+    ]
 
-    return {"snapshots": snapshots_found, "customer_outcomes": customer_outcomes,
-            "depletion_points": depleted_pull_number}
+
+def run_single_simulation(seed: Optional[SeedLike] = None) -> SimulationResult:
+    """Runs one full simulation. See `run_batch_simulations`."""
+    return run_batch_simulations(1, seed)[0]
 
 
 # --- 3. AGGREGATION LOGIC (SIMPLIFIED) ---
@@ -116,66 +183,122 @@ def run_single_simulation() -> SimulationResult:
 class SimulationAggregator:
     """A class to aggregate results from multiple simulation runs."""
 
-    def __init__(self, items: List[str]):
+    def __init__(self, items: List[str], num_runs_expected: int):
         self.items = items
         self.num_runs = 0
-        self.snapshot_levels = ['100%', '75%', '50%', '25%']
+        self.snapshot_levels = list(SNAPSHOT_LEVELS)
+        self._level_index = {level: i for i, level in enumerate(self.snapshot_levels)}
 
-        self.agg_snapshots = {level: {item: 0 for item in self.items} for level in self.snapshot_levels}
+        # Indexed [level, item] in snapshot_levels / items order
+        self.agg_snapshots = np.zeros((len(self.snapshot_levels), len(self.items)), dtype=np.int64)
         self.agg_depletion_pulls = {item: 0 for item in self.items}
         self.agg_depletion_counts = {item: 0 for item in self.items}
 
-        self.snapshot_rate_distributions = {
-            level: {item: [] for item in self.items} for level in self.snapshot_levels
-        }
+        # Indexed [level, item, run]; NaN marks a run whose snapshot was empty
+        self.rate_dist = np.full((len(self.snapshot_levels), len(self.items), num_runs_expected),
+                                 np.nan, dtype=np.float64)
+        self.run_ptr = 0
 
     def add_result(self, result: SimulationResult):
         """Processes a single simulation result and adds it to the aggregate totals."""
         self.num_runs += 1
         self._aggregate_snapshots(result["snapshots"])
         self._aggregate_depletion_points(result["depletion_points"])
+        self.run_ptr += 1
+
+    def add_batch(self, chunk_snap: np.ndarray, chunk_depletion: np.ndarray):
+        """
+        Adds a whole batch of runs at once. `chunk_snap` holds snapshot counts
+        as (runs, levels, items) and `chunk_depletion` holds depletion pull
+        numbers as (runs, items), both in this aggregator's level/item order.
+        """
+        batch_runs = len(chunk_snap)
+        self.num_runs += batch_runs
+        self.agg_snapshots += chunk_snap.sum(axis=0)
+
+        remaining_capsules = chunk_snap.sum(axis=2, keepdims=True)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            chunk_rates = np.where(remaining_capsules > 0, chunk_snap / remaining_capsules, np.nan)
+        self.rate_dist[:, :, self.run_ptr:self.run_ptr + batch_runs] = chunk_rates.transpose(1, 2, 0)
+        self.run_ptr += batch_runs
+
+        depletion_totals = chunk_depletion.sum(axis=0).tolist()
+        for item, pull_total in zip(self.items, depletion_totals):
+            self.agg_depletion_pulls[item] += pull_total
+            self.agg_depletion_counts[item] += batch_runs
 
     # --- CHANGE 3: Snapshot aggregation is now much simpler ---
-    def _aggregate_snapshots(self, snapshots_this_run: Dict[str, Dict[str, int]]):
+    def _aggregate_snapshots(self, snapshots_this_run: Dict[str, Tuple[int, ...]]):
         for level_name, state in snapshots_this_run.items():
-            if level_name in self.snapshot_levels:
-                for item in self.items:
-                    self.agg_snapshots[level_name][item] += state.get(item, 0)
+            level_idx = self._level_index.get(level_name)
+            if level_idx is None:
+                continue
+            vec = np.array(state, dtype=np.int64)
+            self.agg_snapshots[level_idx] += vec
 
-                remaining_capsules = sum(state.values())
-                if remaining_capsules > 0:
-                    for item in self.items:
-                        rate_this_run = state.get(item, 0) / remaining_capsules
-                        self.snapshot_rate_distributions[level_name][item].append(rate_this_run)
+            remaining_capsules = vec.sum()
+            if remaining_capsules > 0:
+                self.rate_dist[level_idx, :, self.run_ptr] = vec / remaining_capsules
 
     def _aggregate_depletion_points(self, depletion_points: Dict[str, int]):
         for item, pull_num in depletion_points.items():
             self.agg_depletion_pulls[item] += pull_num
             self.agg_depletion_counts[item] += 1
 
+    def merge(self, other: "SimulationAggregator"):
+        """Folds another aggregator's totals and rate distributions into this one."""
+        self.num_runs += other.num_runs
+        self.agg_snapshots += other.agg_snapshots
+        self.rate_dist[:, :, self.run_ptr:self.run_ptr + other.run_ptr] = other.rate_dist[:, :, :other.run_ptr]
+        self.run_ptr += other.run_ptr
+        for item in self.items:
+            self.agg_depletion_pulls[item] += other.agg_depletion_pulls[item]
+            self.agg_depletion_counts[item] += other.agg_depletion_counts[item]
+
     def calculate_final_report(self) -> Dict[str, Any]:
         """Calculates final averages and rates from all aggregated data."""
         if self.num_runs == 0: return {}
+        avg_snapshots = self.agg_snapshots / self.num_runs
+        rate_dist = self.rate_dist[:, :, :self.run_ptr]
         return {
             "snapshots": {
-                level: {item: count / self.num_runs for item, count in items.items()}
-                for level, items in self.agg_snapshots.items()
+                level: dict(zip(self.items, avg_snapshots[level_idx].tolist()))
+                for level, level_idx in self._level_index.items()
             },
-            "rate_distributions": self.snapshot_rate_distributions
+            "rate_distributions": {
+                level: {
+                    item: rates[~np.isnan(rates)]
+                    for item, rates in zip(self.items, rate_dist[level_idx])
+                }
+                for level, level_idx in self._level_index.items()
+            }
         }
 
+def aggregate_batch(num_runs: int, seed: Optional[SeedLike] = None) -> SimulationAggregator:
+    """
+    Runs and aggregates one batch, so a worker process hands back a single
+    reduced aggregator instead of every per-run result. The batch arrays go
+    straight into the aggregator without building per-run result dicts.
+    """
+    batch_aggregator = SimulationAggregator(items=ITEMS, num_runs_expected=num_runs)
+    _, snapshot_counts, depletion_points = _simulate_batch_arrays(num_runs, seed)
+    batch_aggregator.add_batch(snapshot_counts, depletion_points)
+    return batch_aggregator
+
 # --- 4. REPORTING ---
 
 def _print_snapshots(report_data: Dict[str, Any]):
     print("\n--- Part 1: Machine State at Depletion Snapshots (Unbiased) ---")
     snapshots = report_data["snapshots"]
-    for level_name in ['100%', '75%', '50%', '25%']:
+    for level_name in SNAPSHOT_LEVELS:
         avg_counts = snapshots.get(level_name, {})
         if not avg_counts: continue
         total_avg_capsules = sum(avg_counts.values())
         print(f"\n  When machine is ~{level_name} FULL (Avg. {total_avg_capsules:.2f} capsules):")
-        sorted_items = sorted(avg_counts.items(), key=lambda item_tuple: item_tuple[1], reverse=True)
-        for item, avg_count in sorted_items:
+        item_names = list(avg_counts)
+        avg_counts_vec = np.fromiter(avg_counts.values(), dtype=np.float64, count=len(item_names))
+        for item_idx in np.argsort(-avg_counts_vec, kind='stable'):
+            item, avg_count = item_names[item_idx], avg_counts_vec[item_idx]
             rate = (avg_count / total_avg_capsules) if total_avg_capsules > 0 else 0
             print(f"    - {item:<18}: {avg_count:>5.2f} avg. units | Rate: {rate:.2%}")
 
@@ -187,12 +310,12 @@ def _print_significance_analysis(report_data: Dict[str, Any]):
 
     print(f"\n  Hypothesis Test for '{item_to_test}' at '{level_to_test}' Fullness:")
     observed_rates = report_data["rate_distributions"][level_to_test][item_to_test]
-    if len(observed_rates) < 2:
+    if observed_rates.size < 2:
         print("    Not enough data to perform significance test.")
         return
 
     t_statistic, p_value = ttest_1samp(a=observed_rates, popmean=baseline_rate)
-    observed_mean = sum(observed_rates) / len(observed_rates)
+    observed_mean = observed_rates.mean()
 
     print(f"    - Null Hypothesis (H₀): The true average rate is equal to the baseline of {baseline_rate:.2%}.")
     print(f"    - Observed Mean Rate: {observed_mean:.4%}")
@@ -219,13 +342,21 @@ def print_advanced_report(final_report_data: Dict[str, Any]):
 
 def main():
     print(f"--- Running {NUM_SIMULATIONS} Simulations (Corrected Measurement) ---")
-    aggregator = SimulationAggregator(items=ITEMS)
+    aggregator = SimulationAggregator(items=ITEMS, num_runs_expected=NUM_SIMULATIONS)
+
+    batch_sizes = [min(SIMULATION_BATCH_SIZE, NUM_SIMULATIONS - batch_start)
+                   for batch_start in range(0, NUM_SIMULATIONS, SIMULATION_BATCH_SIZE)]
+    # Independent child seeds keep every worker's stream statistically separate,
+    # and the same RANDOM_SEED reproduces the same batches regardless of NUM_WORKERS
+    batch_seeds = np.random.SeedSequence(RANDOM_SEED).spawn(len(batch_sizes))
 
     # Use tqdm for a proper progress bar
     from tqdm import tqdm
-    for _ in tqdm(range(NUM_SIMULATIONS), desc="Simulating"):
-        single_run_result = run_single_simulation()
-        aggregator.add_result(single_run_result)
+    with tqdm(total=NUM_SIMULATIONS, desc="Simulating") as progress, \
+            ProcessPoolExecutor(max_workers=NUM_WORKERS) as executor:
+        for batch_aggregator in executor.map(aggregate_batch, batch_sizes, batch_seeds):
+            aggregator.merge(batch_aggregator)
+            progress.update(batch_aggregator.num_runs)
 
     print("--- All simulations complete. Finalizing report. ---")
     final_results = aggregator.calculate_final_report()